@@ -3,13 +3,11 @@
 
 from __future__ import print_function, absolute_import
 
-import six
-
 from click import ParamType
 from enum import Enum
 
 from click_completion.core import completion_configuration, get_code, install, shells, resolve_ctx, get_choices, \
-    startswith, Shell
+    startswith, prefix_matches, Shell, get_bootstrap_code, get_cache_path, install_completion
 from click_completion.lib import get_auto_shell
 from click_completion.patch import patch as _patch
 
@@ -56,13 +54,16 @@ class DocumentedChoice(ParamType):
             self.choices = dict((choice.name, choice.value) for choice in choices)
         else:
             self.choices = dict(choices)
+        self._sorted_keys = sorted(self.choices)
+        self._metavar = '[%s]' % '|'.join(self.choices.keys())
+        formated_choices = ['{:<12} {}'.format(k, self.choices[k] or '') for k in self._sorted_keys]
+        self._missing_message = 'Choose from\n  ' + '\n  '.join(formated_choices)
 
     def get_metavar(self, param):
-        return '[%s]' % '|'.join(self.choices.keys())
+        return self._metavar
 
     def get_missing_message(self, param):
-        formated_choices = ['{:<12} {}'.format(k, self.choices[k] or '') for k in sorted(self.choices.keys())]
-        return 'Choose from\n  ' + '\n  '.join(formated_choices)
+        return self._missing_message
 
     def convert(self, value, param, ctx):
         # Exact match
@@ -85,4 +86,6 @@ class DocumentedChoice(ParamType):
 
     def complete(self, ctx, incomplete):
         match = completion_configuration.match_incomplete
-        return [(c, v) for c, v in six.iteritems(self.choices) if match(c, incomplete)]
+        if match is startswith:
+            return [(c, self.choices[c]) for c in prefix_matches(self._sorted_keys, incomplete)]
+        return [(c, v) for c, v in self.choices.items() if match(c, incomplete)]
@@ -3,17 +3,49 @@
 
 from __future__ import print_function, absolute_import
 
-import distutils.version
+import bisect
+import itertools
 import os
 import re
-import shlex
+import string
 import subprocess
+import sys
+import weakref
 
 import click
-from click import Option, Argument, MultiCommand, echo
+from click import Option, Argument, MultiCommand, Group
 from enum import Enum
 
-from click_completion.lib import resolve_ctx, split_args, single_quote, double_quote, get_auto_shell
+from click_completion.lib import resolve_ctx, split_args, single_quote, double_quote, find_unsafe, get_auto_shell, \
+    write_stdout
+
+
+# backslash escape the whitespaces, quotes and parentheses of the bash completion results
+_BASH_ESCAPE = dict((ord(c), u'\\' + c) for c in u' \t\n\r\x0b\x0c\\"\'()')
+
+# escape the quotes, dollars and backquotes of the zsh completion results
+_ZSH_ESCAPE = {ord(u'"'): u'""', ord(u"'"): u"''", ord(u'$'): u'\\$', ord(u'`'): u'\\`'}
+
+# replace the whitespaces of the fish completion help strings
+_whitespace_sub = re.compile(r'\s').sub
+
+# below this number of subcommands, the linear scan is cheaper than sorting them for prefix_matches()
+_PREFIX_SEARCH_MIN_SIZE = 64
+
+
+class _IdentCharsTable(dict):
+    """A str.translate() table keeping the characters that can be used in the shell function names
+
+    The ASCII letters, digits and underscore are mapped to themselves, and all the other characters are deleted.
+    """
+    def __init__(self):
+        super(_IdentCharsTable, self).__init__((ord(c), c) for c in string.ascii_letters + string.digits + '_')
+
+    def __missing__(self, key):
+        return None
+
+
+_ident_chars_table = _IdentCharsTable()
 
 
 def startswith(string, incomplete):
@@ -36,6 +68,35 @@ def startswith(string, incomplete):
     return string.startswith(incomplete)
 
 
+def prefix_matches(sorted_choices, incomplete):
+    """Returns the choices starting with incomplete
+
+    The choices being sorted, the matches are found with a binary search instead of checking all the choices.
+
+    Parameters
+    ----------
+    sorted_choices : [str]
+        The sorted choices
+    incomplete : str
+        The incomplete string to compare to the begining of the choices
+
+    Returns
+    -------
+    [str]
+        The choices starting with incomplete
+    """
+    lo = hi = bisect.bisect_left(sorted_choices, incomplete)
+    while hi < len(sorted_choices) and sorted_choices[hi].startswith(incomplete):
+        hi += 1
+    return sorted_choices[lo:hi]
+
+
+def _is_prefix_matching():
+    """Returns True when the completion uses the default prefix matching, False when it has been customized"""
+    import click_completion
+    return click_completion.startswith == startswith and completion_configuration.match_incomplete == startswith
+
+
 class CompletionConfiguration(object):
     """A class to hold the completion configuration
 
@@ -64,7 +125,7 @@ def match(string, incomplete):
     return fn(string, incomplete)
 
 
-def get_choices(cli, prog_name, args, incomplete):
+def get_choices(cli, prog_name, args, incomplete, max_results=None):
     """
 
     Parameters
@@ -77,29 +138,24 @@ def get_choices(cli, prog_name, args, incomplete):
         The arguments already written by the user on the command line
     incomplete : str
         The partial argument to complete
+    max_results : int
+        The maximum number of completion results to produce, or None to produce them all (Default value = None)
 
     Returns
     -------
     [(str, str)]
         A list of completion results. The first element of each tuple is actually the argument to complete, the second
-        element is an help string for this argument.
+        element is an help string for this argument. The results are produced lazily.
     """
     ctx = resolve_ctx(cli, prog_name, args)
     if ctx is None:
         return
+    tables = _get_param_tables(ctx)
     optctx = None
     if args:
-        options = [param
-                   for param in ctx.command.get_params(ctx)
-                   if isinstance(param, Option)]
-        arguments = [param
-                     for param in ctx.command.get_params(ctx)
-                     if isinstance(param, Argument)]
-        for param in options:
-            if not param.is_flag and args[-1] in param.opts + param.secondary_opts:
-                optctx = param
+        optctx = tables['opt_index'].get(args[-1])
         if optctx is None:
-            for param in arguments:
+            for param in tables['arguments']:
                 if (
                         not incomplete.startswith("-")
                         and (
@@ -109,30 +165,116 @@ def get_choices(cli, prog_name, args, incomplete):
                 ):
                     optctx = param
                     break
-    choices = []
+    for choice in itertools.islice(_iter_choices(ctx, optctx, tables, incomplete), max_results):
+        yield choice
+
+
+def _iter_choices(ctx, optctx, tables, incomplete):
+    """Generates the completion results of the current command - see get_choices()"""
     if optctx:
-        choices += [c if isinstance(c, tuple) else (c, None) for c in optctx.type.complete(ctx, incomplete)]
+        for c in optctx.type.complete(ctx, incomplete):
+            yield c if isinstance(c, tuple) else (c, None)
     else:
-        for param in ctx.command.get_params(ctx):
-            if (completion_configuration.complete_options or incomplete and not incomplete[:1].isalnum()) and isinstance(param, Option):
-                # filter hidden click.Option
-                if getattr(param, 'hidden', False):
-                    continue
-                for opt in param.opts:
-                    if match(opt, incomplete):
-                        choices.append((opt, param.help))
-                for opt in param.secondary_opts:
-                    if match(opt, incomplete):
-                        # don't put the doc so fish won't group the primary and
-                        # and secondary options
-                        choices.append((opt, None))
+        if completion_configuration.complete_options or incomplete and not incomplete[:1].isalnum():
+            for opt, help in tables['options']:
+                if match(opt, incomplete):
+                    yield (opt, help)
         if isinstance(ctx.command, MultiCommand):
-            for name in ctx.command.list_commands(ctx):
-                if match(name, incomplete):
-                    choices.append((name, ctx.command.get_command_short_help(ctx, name)))
+            names, sorted_names = _get_commands(ctx)
+            if sorted_names is not None and _is_prefix_matching():
+                names = prefix_matches(sorted_names, incomplete)
+            else:
+                names = [name for name in names if match(name, incomplete)]
+            for name in names:
+                yield (name, ctx.command.get_command_short_help(ctx, name))
+
+
+def _get_max_results():
+    """Returns the maximum number of completion results, set with the CLICK_COMPLETION_MAX environment variable
+
+    Returns
+    -------
+    int
+        The maximum number of completion results, or None when they are not limited - including when the value is not
+        a positive or null integer
+    """
+    try:
+        max_results = int(os.environ.get('CLICK_COMPLETION_MAX', ''))
+    except ValueError:
+        return None
+    return max_results if max_results >= 0 else None
+
 
-    for item, help in choices:
-        yield (item, help)
+def _get_param_tables(ctx):
+    """Returns the lookup tables of the current command parameters
+
+    The tables are computed once per command and reused afterwards.
+
+    Parameters
+    ----------
+    ctx : click.core.Context
+        The current context
+
+    Returns
+    -------
+    dict
+        'opt_index' maps the option names expecting a value to their option, 'options' is the list of the visible
+        option names with their help string, and 'arguments' is the list of the arguments.
+    """
+    tables = _param_tables_cache.get(ctx.command)
+    if tables is None:
+        opt_index = {}
+        options = []
+        arguments = []
+        for param in ctx.command.get_params(ctx):
+            if isinstance(param, Argument):
+                arguments.append(param)
+            if not isinstance(param, Option):
+                continue
+            if not param.is_flag:
+                for opt in param.opts + param.secondary_opts:
+                    opt_index[opt] = param
+            # filter hidden click.Option
+            if getattr(param, 'hidden', False):
+                continue
+            options += [(opt, param.help) for opt in param.opts]
+            # don't put the doc so fish won't group the primary and
+            # and secondary options
+            options += [(opt, None) for opt in param.secondary_opts]
+        tables = _param_tables_cache[ctx.command] = {'opt_index': opt_index, 'options': options,
+                                                     'arguments': arguments}
+    return tables
+
+
+def _get_commands(ctx):
+    """Returns the subcommands names of the current command
+
+    The names of a click.Group which doesn't override list_commands() are cached, along with a snapshot of its
+    subcommands names they were computed from, so adding, removing or renaming a subcommand invalidates them. When there
+    are many subcommands, a sorted copy of the names is also kept to search them with prefix_matches(). The other
+    commands may compute their subcommands dynamically, so their names are never cached.
+
+    Parameters
+    ----------
+    ctx : click.core.Context
+        The current context
+
+    Returns
+    -------
+    ([str], [str])
+        The subcommands names, and the sorted subcommands names - None when they are not cached or there are only a few
+        subcommands
+    """
+    command = ctx.command
+    if not isinstance(command, Group) or type(command).list_commands is not Group.list_commands:
+        return command.list_commands(ctx), None
+    snapshot = tuple(command.commands)
+    cached = _list_commands_cache.get(command)
+    if cached is None or cached[0] != snapshot:
+        names = command.list_commands(ctx)
+        sorted_names = sorted(names) if len(names) > _PREFIX_SEARCH_MIN_SIZE else None
+        cached = _list_commands_cache[command] = (snapshot, names, sorted_names)
+    return cached[1:]
 
 
 def do_bash_complete(cli, prog_name):
@@ -150,6 +292,7 @@ def do_bash_complete(cli, prog_name):
     bool
         True if the completion was successful, False otherwise
     """
+    import shlex
     comp_words = os.environ['COMP_WORDS']
     try:
         cwords = shlex.split(comp_words)
@@ -163,12 +306,12 @@ def do_bash_complete(cli, prog_name):
         incomplete = cwords[cword]
     except IndexError:
         incomplete = ''
-    choices = get_choices(cli, prog_name, args, incomplete)
+    choices = get_choices(cli, prog_name, args, incomplete, _get_max_results())
 
     if quoted:
-        echo('\t'.join(opt for opt, _ in choices), nl=False)
+        write_stdout('\t'.join([opt for opt, _ in choices]))
     else:
-        echo('\t'.join(re.sub(r"""([\s\\"'()])""", r'\\\1', opt) for opt, _ in choices), nl=False)
+        write_stdout('\t'.join([opt.translate(_BASH_ESCAPE) for opt, _ in choices]))
 
     return True
 
@@ -196,11 +339,13 @@ def do_fish_complete(cli, prog_name):
     else:
         incomplete = ''
 
-    for item, help in get_choices(cli, prog_name, args, incomplete):
+    lines = []
+    for item, help in get_choices(cli, prog_name, args, incomplete, _get_max_results()):
         if help:
-            echo("%s\t%s" % (item, re.sub(r'\s', ' ', help)))
+            lines.append("%s\t%s\n" % (item, _whitespace_sub(' ', help)))
         else:
-            echo(item)
+            lines.append(item + "\n")
+    write_stdout(''.join(lines))
 
     return True
 
@@ -228,22 +373,33 @@ def do_zsh_complete(cli, prog_name):
     else:
         incomplete = ''
 
-    def escape(s):
-        return s.replace('"', '""').replace("'", "''").replace('$', '\\$').replace('`', '\\`')
-    res = []
-    for item, help in get_choices(cli, prog_name, args, incomplete):
-        if help:
-            res.append(r'"%s"\:"%s"' % (escape(item), escape(help)))
-        else:
-            res.append('"%s"' % escape(item))
-    if res:
-        echo("_arguments '*: :((%s))'" % '\n'.join(res))
-    else:
-        echo("_files")
+    write_stdout(_zsh_arguments(get_choices(cli, prog_name, args, incomplete, _get_max_results())) + '\n')
 
     return True
 
 
+def _zsh_arguments(choices):
+    """Returns the zsh code completing the given choices
+
+    Parameters
+    ----------
+    choices : [(str, str)]
+        The completion results, with their help string
+
+    Returns
+    -------
+    str
+        The zsh code to be evaluated
+    """
+    res = [r'"%s"\:"%s"' % (item.translate(_ZSH_ESCAPE), help.translate(_ZSH_ESCAPE)) if help
+           else '"%s"' % item.translate(_ZSH_ESCAPE)
+           for item, help in choices]
+    if res:
+        return "_arguments '*: :((%s))'" % ' '.join(res)
+    else:
+        return "_files"
+
+
 def do_powershell_complete(cli, prog_name):
     """Do the powershell completion
 
@@ -270,13 +426,85 @@ def do_powershell_complete(cli, prog_name):
         if quote_pos >= 0 and commandline[quote_pos] == '"':
             quote = double_quote
 
-    for item, help in get_choices(cli, prog_name, args, incomplete):
-        echo(quote(item))
+    choices = get_choices(cli, prog_name, args, incomplete, _get_max_results())
+    sys.stdout.write(''.join([quote(item) + '\n' for item, _ in choices]))
+    sys.stdout.flush()
 
     return True
 
 
-def get_code(shell=None, prog_name=None, env_name=None, extra_env=None):
+def get_static_completion(cli, prog_name):
+    """Returns the completion data that the shell can resolve by itself, without calling the program
+
+    The options of the main command and its subcommands names don't depend on what the user has typed, so the shell
+    can complete the first argument, and the options of a command without subcommands, without paying the python
+    startup cost. The program is still called for the arguments and the option values.
+
+    Parameters
+    ----------
+    cli : click.Command
+        The main click Command of the program
+    prog_name : str
+        The program name on the command line
+
+    Returns
+    -------
+    dict
+        The options, the subcommands, the options expecting a value, and the zsh code completing the options and
+        subcommands. None if the completion can't be done statically - for example when a custom matching function is
+        used.
+    """
+    if not _is_prefix_matching():
+        return None
+    ctx = resolve_ctx(cli, prog_name, [])
+    if ctx is None:
+        return None
+    tables = _get_param_tables(ctx)
+    options = tables['options']
+    value_options = list(tables['opt_index'])
+    names = []
+    multicommand = isinstance(ctx.command, MultiCommand)
+    if multicommand:
+        names = list(_get_commands(ctx)[0])
+    words = [opt for opt, _ in options] + names + value_options
+    if any(find_unsafe(word) is not None for word in words):
+        return None
+    # the subcommands short help may require to load all the subcommands, so they are not displayed here
+    commands = [(name, None) for name in names]
+    return {
+        'options': [opt for opt, _ in options],
+        'commands': names,
+        'value_options': value_options,
+        'multicommand': multicommand,
+        'complete_options': completion_configuration.complete_options,
+        'zsh_options': _zsh_arguments(options + commands),
+        'zsh_commands': _zsh_arguments(commands),
+    }
+
+
+def _script_identifiers(prog_name):
+    """Returns the default completion environment variable name and the completion function name of a program
+
+    Parameters
+    ----------
+    prog_name : str
+        The program name on the command line
+
+    Returns
+    -------
+    (str, str)
+        The environment variable name used to control the completion, and the program name sanitized to be used in
+        the shell function names
+    """
+    identifiers = _script_identifiers_cache.get(prog_name)
+    if identifiers is None:
+        name = prog_name.replace('-', '_')
+        identifiers = _script_identifiers_cache[prog_name] = (
+            '_%s_COMPLETE' % name.upper(), name.translate(_ident_chars_table))
+    return identifiers
+
+
+def get_code(shell=None, prog_name=None, env_name=None, extra_env=None, cli=None):
     """Returns the completion code to be evaluated by the shell
 
     Parameters
@@ -289,34 +517,54 @@ def get_code(shell=None, prog_name=None, env_name=None, extra_env=None):
         The environment variable used to control the completion (Default value = None)
     extra_env : dict
         Some extra environment variables to be added to the generated code (Default value = None)
+    cli : click.Command
+        The main click Command of the program. When given, the generated code completes the options and subcommands
+        without calling the program whenever possible (Default value = None)
 
     Returns
     -------
     str
         The code to be evaluated by the shell
     """
-    from jinja2 import Environment, FileSystemLoader
     if shell in [None, 'auto']:
         shell = get_auto_shell()
     if not isinstance(shell, Shell):
         shell = Shell[shell]
     prog_name = prog_name or click.get_current_context().find_root().info_name
-    env_name = env_name or '_%s_COMPLETE' % prog_name.upper().replace('-', '_')
+    complete_var, cf_name = _script_identifiers(prog_name)
+    env_name = env_name or complete_var
     extra_env = extra_env if extra_env else {}
+    # the rendered code only depends on these values, so render it once per process
+    key = (shell, prog_name, env_name, tuple(sorted(extra_env.items())), cli)
+    code = _code_cache.get(key)
+    if code is None:
+        code = _code_cache[key] = _render_code(shell, prog_name, cf_name, env_name, extra_env, cli)
+    return code
+
+
+def _render_code(shell, prog_name, cf_name, env_name, extra_env, cli):
+    """Renders the completion code template for the given shell"""
+    import distutils.version
+    from jinja2 import Environment, FileSystemLoader
     env = Environment(loader=FileSystemLoader(os.path.dirname(__file__)))
 
     click_ver = distutils.version.StrictVersion(click.__version__)
     click8_ver = distutils.version.StrictVersion('8.0.0')
+    static = None
     if click_ver >= click8_ver:
         template_name = '%s-click8.j2'
     else:
         template_name = '%s.j2'
+        # only the bash and zsh templates complete statically
+        if cli is not None and shell in (Shell.bash, Shell.zsh):
+            static = get_static_completion(cli, prog_name)
     template = env.get_template(template_name % shell.name)
 
-    return template.render(prog_name=prog_name, complete_var=env_name, extra_env=extra_env)
+    return template.render(prog_name=prog_name, cf_name=cf_name, complete_var=env_name, extra_env=extra_env,
+                           static=static)
 
 
-def install(shell=None, prog_name=None, env_name=None, path=None, append=None, extra_env=None):
+def install(shell=None, prog_name=None, env_name=None, path=None, append=None, extra_env=None, cli=None):
     """Install the completion
 
     Parameters
@@ -337,6 +585,10 @@ def install(shell=None, prog_name=None, env_name=None, path=None, append=None, e
         (Default value = None)
     extra_env : dict
         A set of environment variables and their values to be added to the generated code (Default value = None)
+    cli : click.Command
+        The main click Command of the program. When given, the installed code completes the options and subcommands
+        without calling the program whenever possible. As they are embedded in the installed code, the completion must
+        then be installed again after each upgrade of the program (Default value = None)
     """
     prog_name = prog_name or click.get_current_context().find_root().info_name
     shell = shell or get_auto_shell()
@@ -375,12 +627,121 @@ def install(shell=None, prog_name=None, env_name=None, path=None, append=None, e
     if not os.path.exists(d):
         os.makedirs(d)
     f = open(path, mode)
-    f.write(get_code(shell, prog_name, env_name, extra_env))
+    f.write(get_code(shell, prog_name, env_name, extra_env, cli))
     f.write("\n")
     f.close()
     return shell, path
 
 
+def get_cache_path(shell, prog_name):
+    """Returns the path of the cached completion code
+
+    The completion code is cached in $XDG_CACHE_HOME/click-completion, or ~/.cache/click-completion when
+    XDG_CACHE_HOME is not set.
+
+    Parameters
+    ----------
+    shell : Shell
+        The shell type
+    prog_name : str
+        The program name on the command line
+
+    Returns
+    -------
+    str
+        The path of the cached completion code
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'click-completion', _cache_file_name(shell, prog_name))
+
+
+def _cache_file_name(shell, prog_name):
+    """Returns the file name of the cached completion code - see get_cache_path()"""
+    if not isinstance(shell, Shell):
+        shell = Shell[shell]
+    ext = 'ps1' if shell == Shell.powershell else shell.name
+    return '%s.%s' % (prog_name, ext)
+
+
+def get_bootstrap_code(shell=None, prog_name=None, env_name=None):
+    """Returns the code to be put in the shell startup file to load the cached completion code
+
+    The bootstrap code sources the completion code cached by install_completion(), and only calls the program to
+    generate it when it is missing or older than the program executable - for example after an upgrade - so the shell
+    startup doesn't pay the program startup cost.
+
+    Parameters
+    ----------
+    shell : Shell
+        The shell type. It will be guessed with get_auto_shell() if the value is None (Default value = None)
+    prog_name : str
+        The program name on the command line. It will be automatically computed if the value is None
+        (Default value = None)
+    env_name : str
+        The environment variable name used to control the completion. It will be automatically computed if the value is
+        None (Default value = None)
+
+    Returns
+    -------
+    str
+        The code to be evaluated by the shell at startup
+    """
+    from jinja2 import Environment, FileSystemLoader
+    if shell in [None, 'auto']:
+        shell = get_auto_shell()
+    if not isinstance(shell, Shell):
+        shell = Shell[shell]
+    prog_name = prog_name or click.get_current_context().find_root().info_name
+    complete_var, cf_name = _script_identifiers(prog_name)
+    env_name = env_name or complete_var
+    env = Environment(loader=FileSystemLoader(os.path.dirname(__file__)))
+    template = env.get_template('bootstrap.j2')
+    return template.render(shell=shell.name, prog_name=prog_name, cf_name=cf_name, complete_var=env_name,
+                           file_name=_cache_file_name(shell, prog_name))
+
+
+def install_completion(shell=None, prog_name=None, env_name=None, cli=None):
+    """Writes the completion code in the cache directory, where the bootstrap code loads it from
+
+    The written code is the same as the one generated by the bootstrap code when the cached file is missing.
+
+    Parameters
+    ----------
+    shell : Shell
+        The shell type. It will be guessed with get_auto_shell() if the value is None (Default value = None)
+    prog_name : str
+        The program name on the command line. It will be automatically computed if the value is None
+        (Default value = None)
+    env_name : str
+        The environment variable name used to control the completion. It will be automatically computed if the value is
+        None (Default value = None)
+    cli : click.Command
+        The main click Command of the program. It will be automatically computed if the value is None
+        (Default value = None)
+
+    Returns
+    -------
+    (str, str)
+        The shell type and the path of the cached completion code
+    """
+    if shell in [None, 'auto']:
+        shell = get_auto_shell()
+    if not isinstance(shell, Shell):
+        shell = Shell[shell]
+    prog_name = prog_name or click.get_current_context().find_root().info_name
+    cli = cli or click.get_current_context().find_root().command
+    path = get_cache_path(shell, prog_name)
+    d = os.path.dirname(path)
+    if not os.path.exists(d):
+        os.makedirs(d)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(get_code(shell, prog_name, env_name, cli=cli))
+        f.write("\n")
+    os.replace(tmp_path, path)
+    return shell.name, path
+
+
 class Shell(Enum):
     bash = 'Bourne again shell'
     fish = 'Friendly interactive shell'
@@ -388,6 +749,18 @@ class Shell(Enum):
     powershell = 'Windows PowerShell'
 
 
+# the parameters lookup tables, keyed by command
+_param_tables_cache = weakref.WeakKeyDictionary()
+
+# the subcommands names, with the subcommands snapshot they were computed from, keyed by command
+_list_commands_cache = weakref.WeakKeyDictionary()
+
+# the completion identifiers, keyed by program name
+_script_identifiers_cache = {}
+
+# rendered completion code, keyed by (shell, prog_name, env_name, extra_env, cli)
+_code_cache = {}
+
 # deprecated - use Shell instead
 shells = dict((shell.name, shell.value) for shell in Shell)
 
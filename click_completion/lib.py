@@ -3,14 +3,24 @@
 
 from __future__ import print_function, absolute_import
 
+import io
+import os
 import re
-import shlex
+import string
+import sys
 
 import click
 import shellingham
 from click import MultiCommand
 
 find_unsafe = re.compile(r'[^\w@%+=:,./-]').search
+# the most common safe characters, checked without the regex engine for the short strings
+_safe_chars = frozenset(string.ascii_letters + string.digits + '@%+=:,./-_')
+
+# the shlex posix tokens: whitespace, escaped character, double quoted string, single quoted string, anything else.
+# The closing quotes are optional to accept the incomplete strings.
+_split_args_re = re.compile(r'''([ \t\r\n]+)|\\(.?)|"((?:\\.|[^"\\])*)"?|'([^']*)'?|([^ \t\r\n\\"']+)''', re.DOTALL)
+_double_quote_escape_re = re.compile(r'\\([\\"])')
 
 
 def single_quote(s):
@@ -28,7 +38,7 @@ def single_quote(s):
     """
     if not s:
         return "''"
-    if find_unsafe(s) is None:
+    if len(s) < 64 and _safe_chars.issuperset(s) or find_unsafe(s) is None:
         return s
 
     # use single quotes, and put single quotes into double quotes
@@ -51,7 +61,7 @@ def double_quote(s):
     """
     if not s:
         return '""'
-    if find_unsafe(s) is None:
+    if len(s) < 64 and _safe_chars.issuperset(s) or find_unsafe(s) is None:
         return s
 
     # use double quotes, and put double quotes into single quotes
@@ -70,6 +80,8 @@ def resolve_ctx(cli, prog_name, args, resilient_parsing=True):
         The program name on the command line
     args : [str]
         The arguments already written by the user on the command line
+    resilient_parsing : bool
+        Whether the parsing errors are ignored (Default value = True)
 
     Returns
     -------
@@ -104,22 +116,49 @@ def split_args(line):
     [str]
         The line split in separated arguments
     """
-    lex = shlex.shlex(line, posix=True)
-    lex.whitespace_split = True
-    lex.commenters = ''
     res = []
-    try:
-        while True:
-            res.append(next(lex))
-    except ValueError:  # No closing quotation
-        pass
-    except StopIteration:  # End of loop
-        pass
-    if lex.token:
-        res.append(lex.token)
+    token = None
+    m = None
+    for m in _split_args_re.finditer(line):
+        kind = m.lastindex
+        if kind == 1:  # whitespace
+            if token is not None:
+                res.append(token)
+            token = None
+            continue
+        value = m.group(kind)
+        if kind == 3:  # double quoted: only the quote and the backslash may be escaped
+            value = _double_quote_escape_re.sub(r'\1', value)
+        token = (token or '') + value
+    # like shlex, drop an empty token left by an unterminated quote or escape
+    if token is not None and (token or m.group(0) not in ('"', "'", '\\')):
+        res.append(token)
     return res
 
 
+def write_stdout(text):
+    """Writes some text to the standard output, encoded in UTF-8
+
+    The encoded text is written directly to the standard output file descriptor, bypassing the python text layer. The
+    standard output text stream is used when it has no file descriptor - for example when it has been replaced.
+
+    Parameters
+    ----------
+    text : str
+        The text to write
+    """
+    try:
+        fd = sys.stdout.fileno()
+    except (AttributeError, ValueError, io.UnsupportedOperation):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        return
+    sys.stdout.flush()
+    data = text if isinstance(text, bytes) else text.encode('utf-8')
+    while data:
+        data = data[os.write(fd, data):]
+
+
 def get_auto_shell():
     """Returns the current shell"""
     return shellingham.detect_shell()[0]
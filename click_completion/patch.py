@@ -3,17 +3,21 @@
 
 from __future__ import print_function, absolute_import
 
+import json
 import os
 import sys
 
 import click
-from click import echo
 
 from click_completion.core import do_bash_complete, do_fish_complete, do_zsh_complete, do_powershell_complete,\
-    get_code, install, completion_configuration
+    get_code, install, completion_configuration, startswith, prefix_matches, _script_identifiers
+from click_completion.lib import write_stdout
 
 """All the code used to monkey patch click"""
 
+# the subcommands short help persisted in CLICK_COMPLETION_CACHE_DIR, keyed by file path
+_short_help_stores = {}
+
 
 def param_type_complete(self, ctx, incomplete):
     """Returns a set of possible completions values, along with their documentation string
@@ -51,6 +55,13 @@ def choice_complete(self, ctx, incomplete):
     [(str, str)]
         A list of completion results
     """
+    if completion_configuration.match_incomplete is startswith:
+        # keep the sorted choices along with the choices they were computed from, in case they are replaced
+        choices, sorted_choices = self.__dict__.get('_sorted_choices', (None, None))
+        if choices is not self.choices:
+            sorted_choices = sorted(self.choices)
+            self._sorted_choices = (self.choices, sorted_choices)
+        return [(c, None) for c in prefix_matches(sorted_choices, incomplete)]
     return [
         (c, None) for c in self.choices
         if completion_configuration.match_incomplete(c, incomplete)
@@ -75,7 +86,75 @@ def multicommand_get_command_short_help(self, ctx, cmd_name):
     str
         The sub command short help
     """
-    return self.get_command(ctx, cmd_name).get_short_help_str()
+    cache = self.__dict__.setdefault('_short_help_cache', {})
+    short_help = cache.get(cmd_name)
+    if short_help is None:
+        persisted = _get_persisted_short_help(ctx)
+        key = '%s %s' % (ctx.command_path, cmd_name)
+        if persisted is not None:
+            short_help = persisted.get(key)
+        if short_help is None:
+            cmd = self.get_command(ctx, cmd_name)
+            short_help = cmd.get_short_help_str() if cmd else ''
+            if persisted is not None:
+                persisted[key] = short_help
+        cache[cmd_name] = short_help
+    return short_help
+
+
+def _get_persisted_short_help(ctx):
+    """Returns the subcommands short help stored in CLICK_COMPLETION_CACHE_DIR, keyed by command path
+
+    The short help are stored in <prog_name>.shorthelp.json, along with the modification time of the program, so they
+    are recomputed when the program is updated. An unreadable or invalid file is ignored.
+
+    Parameters
+    ----------
+    ctx : click.core.Context
+        The current context
+
+    Returns
+    -------
+    dict
+        The short help, keyed by the full command path of the subcommands. None when the CLICK_COMPLETION_CACHE_DIR
+        environment variable is not set.
+    """
+    cache_dir = os.environ.get('CLICK_COMPLETION_CACHE_DIR')
+    if not cache_dir:
+        return None
+    path = os.path.join(os.path.expanduser(cache_dir), '%s.shorthelp.json' % ctx.find_root().info_name)
+    store = _short_help_stores.get(path)
+    if store is None:
+        mtime = os.path.getmtime(sys.argv[0]) if os.path.exists(sys.argv[0]) else None
+        short_help = {}
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get('mtime') == mtime and isinstance(data['short_help'], dict):
+                short_help = data['short_help']
+        except (OSError, ValueError, KeyError, AttributeError):  # missing or corrupted cache file - just recompute it
+            pass
+        store = _short_help_stores[path] = {'mtime': mtime, 'size': len(short_help), 'short_help': short_help}
+    return store['short_help']
+
+
+def _save_persisted_short_help():
+    """Writes the subcommands short help computed by this process in CLICK_COMPLETION_CACHE_DIR
+
+    The errors are ignored: the short help will just be computed again by the next completion.
+    """
+    for path, store in _short_help_stores.items():
+        if len(store['short_help']) == store['size']:
+            continue
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            tmp_path = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump({'mtime': store['mtime'], 'short_help': store['short_help']}, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
 
 
 def multicommand_get_command_hidden(self, ctx, cmd_name):
@@ -113,30 +192,34 @@ def _shellcomplete(cli, prog_name, complete_var=None):
         The environment variable name used to control the completion behavior (Default value = None)
     """
     if complete_var is None:
-        complete_var = '_%s_COMPLETE' % (prog_name.replace('-', '_')).upper()
+        complete_var = _script_identifiers(prog_name)[0]
     complete_instr = os.environ.get(complete_var)
     if not complete_instr:
         return
 
     if complete_instr == 'source':
-        echo(get_code(prog_name=prog_name, env_name=complete_var))
+        write_stdout(get_code(None, prog_name, complete_var, cli=cli) + '\n')
     elif complete_instr == 'source-bash':
-        echo(get_code('bash', prog_name, complete_var))
+        write_stdout(get_code('bash', prog_name, complete_var, cli=cli) + '\n')
     elif complete_instr == 'source-fish':
-        echo(get_code('fish', prog_name, complete_var))
+        write_stdout(get_code('fish', prog_name, complete_var, cli=cli) + '\n')
     elif complete_instr == 'source-powershell':
-        echo(get_code('powershell', prog_name, complete_var))
+        write_stdout(get_code('powershell', prog_name, complete_var, cli=cli) + '\n')
     elif complete_instr == 'source-zsh':
-        echo(get_code('zsh', prog_name, complete_var))
+        write_stdout(get_code('zsh', prog_name, complete_var, cli=cli) + '\n')
     elif complete_instr in ['complete', 'complete-bash']:
         # keep 'complete' for bash for backward compatibility
         do_bash_complete(cli, prog_name)
+        _save_persisted_short_help()
     elif complete_instr == 'complete-fish':
         do_fish_complete(cli, prog_name)
+        _save_persisted_short_help()
     elif complete_instr == 'complete-powershell':
         do_powershell_complete(cli, prog_name)
+        _save_persisted_short_help()
     elif complete_instr == 'complete-zsh':
         do_zsh_complete(cli, prog_name)
+        _save_persisted_short_help()
     elif complete_instr == 'install':
         shell, path = install(prog_name=prog_name, env_name=complete_var)
         click.echo('%s completion installed in %s' % (shell, path))
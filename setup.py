@@ -21,12 +21,11 @@ setup(
     url='https://github.com/click-contrib/click-completion',
     license='MIT',
     packages=find_packages(),
+    python_requires='>=3.5',
     package_data={'': ['*.j2']},
     install_requires=[
         'click',
         'jinja2',
-        'six',
         'shellingham',
-        'enum34; python_version<"3"',
     ],
 )